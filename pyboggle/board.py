@@ -1,15 +1,29 @@
 import curses
-import itertools
+import os
 import random
-from dataclasses import dataclass
-from functools import cached_property
-from typing import List, Optional, Set, Tuple, Union
-
-from networkx import Graph, is_simple_path
-
-from .words import WordTree
-
-CLASSIC_TILES = [
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .words import (
+    ALPHABET_SIZE,
+    MIN_WORD_LENGTH,
+    ROOT_NODE,
+    WordTree,
+    get_word_tree,
+)
+
+CLASSIC_TILES = (
     ("A", "A", "C", "I", "O", "T"),
     ("A", "B", "I", "L", "T", "Y"),
     ("A", "B", "J", "M", "O", "Qu"),
@@ -26,8 +40,8 @@ CLASSIC_TILES = [
     ("E", "H", "I", "N", "P", "S"),
     ("E", "L", "P", "S", "T", "U"),
     ("G", "I", "L", "R", "U", "W"),
-]
-NEW_TILES = [
+)
+NEW_TILES = (
     ("A", "A", "E", "E", "G", "N"),
     ("A", "B", "B", "J", "O", "O"),
     ("A", "C", "H", "O", "P", "S"),
@@ -44,28 +58,189 @@ NEW_TILES = [
     ("E", "L", "R", "T", "T", "Y"),
     ("H", "I", "M", "N", "U", "Qu"),
     ("H", "L", "N", "N", "R", "Z"),
-]
+)
+# relative to this module, so that the word list is found from any directory
+WORD_LIST = os.path.join(os.path.dirname(__file__), "word_lists", "csw15.txt")
 
 
-@dataclass(frozen=True)
-class Dice:
+def _compute_neighbors() -> Tuple[int, ...]:
     """
-    An object that represents a single physical dice
-    on a physical Boggle board.
+    Computes the adjacency table of a 4 x 4 board,
+    where each dice is referred to by its index y * 4 + x.
+
+    Returns:
+        Tuple[int, ...]: Neighbour bitmasks, one per dice index.
+            Bit j of neighbors[i] is set if dice j is adjacent to dice i.
     """
+    neighbors = []
+    for y in range(4):
+        for x in range(4):
+            mask = 0
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    if dx == dy == 0:
+                        continue
+                    adjusted_x, adjusted_y = x + dx, y + dy
+                    if 0 <= adjusted_x < 4 and 0 <= adjusted_y < 4:
+                        mask |= 1 << (adjusted_y * 4 + adjusted_x)
+            neighbors.append(mask)
+    return tuple(neighbors)
+
+
+NEIGHBORS = _compute_neighbors()
+# letter codes as used by WordTree, with the two letter face "Qu" as its own code
+Q_CODE = ord("Q") - 65
+U_CODE = ord("U") - 65
+QU_CODE = ALPHABET_SIZE
+# letters spelt by each face code
+CODE_LETTERS = tuple(chr(code + 65) for code in range(ALPHABET_SIZE)) + ("QU",)
+# solvers pack words into ints, with LETTER_BITS per letter storing its code + 1
+LETTER_BITS = 5
+LETTER_MASK = (1 << LETTER_BITS) - 1
+# the smallest packed word of MIN_WORD_LENGTH letters
+MIN_PACKED_WORD = 1 << ((MIN_WORD_LENGTH - 1) * LETTER_BITS)
+
+
+def face_code(face: str) -> int:
+    """Get the letter code of a face, with A as 0 to Z as 25, and "Qu" as QU_CODE."""
+    return QU_CODE if face == "Qu" else ord(face) - 65
+
+
+def unpack_word(packed: int) -> str:
+    """Get the word stored in a packed int, see LETTER_BITS."""
+    letters = []
+    while packed:
+        letters.append(chr((packed & LETTER_MASK) + 64))
+        packed >>= LETTER_BITS
+    return "".join(reversed(letters))
+
+
+# a DFS step function, called with (visited_mask, node, packed)
+Step = Callable[[int, int, int], None]
+# source of the DFS step for a single dice, see _generate_make_steps
+_STEP_HEAD = """
+    def step_{dice}(visited_mask, node, packed):
+        if is_word[node] and packed >= MIN_PACKED_WORD:
+            words.append(packed)
+        children = next_mask[node]
+"""
+_STEP_NEIGHBOR = """
+        if not visited_mask & {bit} and children & lead_bits[{child}]:
+            child_node = follow(node, face_codes[{child}])
+            if child_node >= 0:
+                step_{child}(
+                    visited_mask | {bit},
+                    child_node,
+                    packed << shifts[{child}] | packs[{child}],
+                )
+"""
+
+
+def _generate_make_steps() -> Callable[..., Tuple[Step, ...]]:
+    """
+    Generates make_steps, which takes the state of a solve and returns
+    one DFS step function per dice. As NEIGHBORS is fixed, the loop over
+    the neighbours of each dice is unrolled into straight line code.
+
+    step_i(visited_mask, node, packed) searches all paths extending from
+    dice i, where packed is the word spelt by the path so far, packed into
+    an int, and node is the word_tree node reached by that word. Words are
+    emitted as packed ints, which are cheaper to hash than strs, and are
+    only unpacked once the search is done. Only paths which are valid in
+    word_tree are traversed.
+
+    The search is not memoised on (dice, visited_mask, node), as that state
+    is only reached again by a different ordering of the same dice spelling
+    the same prefix, which needs repeated letters. Under 1% of states are
+    revisited on random boards, so storing the words below every state
+    costs far more than it saves.
+
+    Returns:
+        Callable[..., Tuple[Step, ...]]: make_steps
+    """
+    source = [
+        "def make_steps(words, face_codes, shifts, packs, lead_bits,"
+        " follow, is_word, next_mask):"
+    ]
+    for dice, neighbors in enumerate(NEIGHBORS):
+        source.append(_STEP_HEAD.format(dice=dice))
+        for child in range(len(NEIGHBORS)):
+            if neighbors >> child & 1:
+                source.append(_STEP_NEIGHBOR.format(child=child, bit=1 << child))
+    steps = ", ".join(f"step_{dice}" for dice in range(len(NEIGHBORS)))
+    source.append(f"    return ({steps},)")
 
-    faces: Tuple[str]
+    namespace = {"MIN_PACKED_WORD": MIN_PACKED_WORD}
+    exec(compile("".join(source), "<pyboggle steps>", "exec"), namespace)
+    return namespace["make_steps"]
 
-    @cached_property
-    def face(self):
-        """Exploit cached property to always reuse the first randomly chosen face."""
-        return random.choice(self.faces)
+
+_make_steps = _generate_make_steps()
+
+
+def solve_board(face_codes: Sequence[int], word_tree: WordTree) -> Set[str]:
+    """
+    Get all valid words in a board, given as a flat sequence of face codes
+    indexed by dice position.
+
+    This is kept as plain functions over ints, with attribute lookups
+    hoisted out of the DFS, as it is the hot loop of the solver.
+
+    Args:
+        face_codes (Sequence[int]): Face code of each dice, as per face_code.
+        word_tree (WordTree): Word list to check paths against.
+
+    Returns:
+        Set[str]: Set of all valid words in board.
+    """
+    # a word is appended once for every path spelling it
+    words: List[int] = []
+    # each face as a packed int, and the number of bits it is packed into
+    shifts = array("b")
+    packs = array("l")
+    for code in face_codes:
+        packed = 0
+        for letter in CODE_LETTERS[code]:
+            packed = packed << LETTER_BITS | (ord(letter) - 64)
+        shifts.append(len(CODE_LETTERS[code]) * LETTER_BITS)
+        packs.append(packed)
+    # bit of the first letter of each face, to check against next_mask
+    lead_bits = array(
+        "l", [1 << (Q_CODE if code == QU_CODE else code) for code in face_codes]
+    )
+    advance = word_tree.advance
+
+    def follow(node: int, code: int) -> int:
+        """Advance node by a face code, where "Qu" consumes both letters."""
+        if code == QU_CODE:
+            node = advance(node, Q_CODE)
+            if node < 0:
+                return node
+            code = U_CODE
+        return advance(node, code)
+
+    steps = _make_steps(
+        words,
+        face_codes,
+        shifts,
+        packs,
+        lead_bits,
+        follow,
+        word_tree.is_word,
+        word_tree.next_mask,
+    )
+    for start, code in enumerate(face_codes):
+        node = follow(ROOT_NODE, code)
+        if node >= 0:
+            steps[start](1 << start, node, packs[start])
+    return {unpack_word(packed) for packed in set(words)}
 
 
 class BoggleBoard:
     """
     An object that represents a physical Boggle board, of size 4 x 4.
-    Each dice/tile/dice (the chosen term is dice) is represented by a Dice object.
+    Each dice/tile/dice (the chosen term is dice) is represented by its chosen face,
+    stored in a flat tuple indexed by y * 4 + x.
     """
 
     def __init__(self, tiles: str = "classic") -> None:
@@ -75,108 +250,40 @@ class BoggleBoard:
             self.tiles = NEW_TILES
         else:
             raise ValueError(f"Invalid tile set {tiles}.")
-        self.dice: List[List[Dice]] = self._create_dice()
-        self.adjacency = self._create_adjacency_graph()
-        filter = "".join(d.face for d in itertools.chain(*self.dice))
-        self.word_tree = WordTree("pyboggle/word_lists/csw15.txt", filter=filter)
+        self.faces: Tuple[str, ...] = self._create_dice()
+        # plain int arrays, which are compact and quick to index
+        self.face_codes = array("b", map(face_code, self.faces))
+        self.neighbors = self._create_adjacency_graph()
+        self.word_tree = get_word_tree(WORD_LIST)
 
-    def _create_dice(self) -> List[List[Dice]]:
+    def _create_dice(self) -> Tuple[str, ...]:
         """
-        Randomly creates 4x4 Dice based on a chosen tileset.
+        Randomly creates 4x4 dice based on a chosen tileset,
+        and rolls each dice once to choose its face.
 
         Returns:
-            List[List[Dice]]: 2D list of Dice
+            Tuple[str, ...]: Flat tuple of 16 faces, row by row
         """
-        random.shuffle(self.tiles)
-        dice = []
-        for i in range(4):
-            dice_row = []
-            for j in range(4):
-                tile = self.tiles[(i * 4) + j]
-                dice_row.append(Dice(tile))
-            dice.append(dice_row)
-        return dice
-
-    def _create_adjacency_graph(self) -> Graph:
-        """
-        Generates an internal adjacency graph to record positions of Dice.
+        tiles = random.sample(self.tiles, 16)
+        return tuple(random.choice(tile) for tile in tiles)
 
-        Returns:
-            Graph: Undirected graph which contains information of Dice positions.
-                Each node label is a Dice object, with no node attributes.
+    def _create_adjacency_graph(self) -> array:
         """
-        graph = Graph()
-        for y, dice_row in enumerate(self.dice):
-            for x, dice in enumerate(dice_row):
-                idx_adjustments = (-1, 0, 1)
-                adjustments = list(itertools.product(idx_adjustments, idx_adjustments))
-                adjusted_idxs = set((x + i, y + j) for i, j in adjustments)
-                for adjusted_x, adjusted_y in adjusted_idxs:
-                    if adjusted_y < 0 or adjusted_x < 0:
-                        continue
-                    try:
-                        adj_dice = self.dice[adjusted_y][adjusted_x]
-                    except IndexError:
-                        continue
-                    if dice != adj_dice:
-                        graph.add_edge(dice, adj_dice)
-        return graph
-
-    def _all_simple_paths_graph(self, source: Dice, target: Dice):
-        """
-        A modified version of networkx.algorithms._all_simple_paths_graph.
-        Carries out all path traversals similar to the original, but early
-        exits when an invalid path according to word.WordTree.tree is encountered.
+        Gets the internal adjacency table which records positions of dice.
+        Each dice is referred to by its index in self.faces, i.e. y * 4 + x.
 
-        Args:
-            source (Dice): A Dice object in self.adjacency
-            target (Dice): A Dice object in self.adjacency
-
-        Yields:
-            List[Dice]: A list of Dice objects forming a path.
-                This will be a valid path, but may not be a valid word.
+        Returns:
+            array: Neighbour bitmasks, one per dice index.
+                Bit j of neighbors[i] is set if dice j is adjacent to dice i.
         """
-        # modification 1: accept a single target directly
-        targets = set([target])
-        cutoff = len(self.adjacency) - 1
-        visited = dict.fromkeys([source])
-        stack = [iter(self.adjacency[source])]
-        while stack:
-            # modification 2: add early exit check for path traversal
-            if visited_word := "".join(dice.face for dice in visited.keys()):
-                if self.word_tree.search_path(visited_word) is None:
-                    # early exit this path if not valid in self.word_tree.tree
-                    stack.pop()
-                    visited.popitem()
-                    continue
-            children = stack[-1]
-            child: Optional[Dice] = next(children, None)
-            if child is None:
-                stack.pop()
-                visited.popitem()
-            elif len(visited) < cutoff:
-                if child in visited:
-                    continue
-                if child in targets:
-                    if self.word_tree.search_path(visited_word + child.face):
-                        yield list(visited) + [child]
-                visited[child] = None
-                if targets - set(visited.keys()):  # expand stack until find all targets
-                    stack.append(iter(self.adjacency[child]))
-                else:
-                    visited.popitem()  # maybe other ways to child
-            else:  # len(visited) == cutoff:
-                for target in (targets & (set(children) | {child})) - set(
-                    visited.keys()
-                ):
-                    yield list(visited) + [target]
-                stack.pop()
-                visited.popitem()
+        # the layout of a 4 x 4 board never changes, so this is precomputed
+        return array("q", NEIGHBORS)
 
     def _is_valid_path(self, word: str) -> bool:
         """
-        Given a word, make a generator of all possible dice paths that can make that word,
-        and check if any of those paths are valid in self.adjacency.
+        Given a word, do a depth first search of dice paths that can make
+        that word, checking only dice which are adjacent to the previous
+        dice, not yet visited, and have the correct face.
 
         Args:
             word (str): Word to check.
@@ -184,13 +291,27 @@ class BoggleBoard:
         Returns:
             bool: Whether word is a valid path or not
         """
-        all_dice = list(itertools.chain(*self.dice))
-        # for each char, a generator of dice which has the correct face
-        matching_dice = [
-            [dice for dice in all_dice if dice.face == char] for char in word
-        ]
-        path_permutations = list(itertools.product(*matching_dice))
-        return any(is_simple_path(self.adjacency, path) for path in path_permutations)
+        # bitmask of dice with each face, where "Qu" matches the letters QU
+        face_masks: Dict[str, int] = {}
+        for i, face in enumerate(self.faces):
+            face = face.upper()
+            face_masks[face] = face_masks.get(face, 0) | 1 << i
+
+        def search(i: int, candidates: int, visited_mask: int) -> bool:
+            if i == len(word):
+                return True
+            face = word[i : i + 2] if word[i] == "Q" else word[i]
+            candidates &= face_masks.get(face, 0) & ~visited_mask
+            while candidates:
+                bit = candidates & -candidates
+                candidates ^= bit
+                dice = bit.bit_length() - 1
+                if search(i + len(face), self.neighbors[dice], visited_mask | bit):
+                    return True
+            return False
+
+        # any dice can start the path
+        return bool(word) and search(0, (1 << len(self.faces)) - 1, 0)
 
     def solver(self) -> Set[str]:
         """
@@ -199,19 +320,7 @@ class BoggleBoard:
         Returns:
             Set[str]: Set of all valid words in board.
         """
-        words: Set[str] = set()
-        dice = itertools.chain(*self.dice)
-        combinations = itertools.combinations(dice, 2)
-        for dice1, dice2 in combinations:
-            paths = self._all_simple_paths_graph(dice1, dice2)
-            reversed_paths = self._all_simple_paths_graph(dice2, dice1)
-            all_paths = itertools.chain(paths, reversed_paths)
-            for path in all_paths:
-                if path:
-                    if self.word_tree.exists(
-                        word := "".join(dice.face for dice in path)
-                    ):
-                        words.add(word)
+        words = solve_board(self.face_codes, self.word_tree)
         print(f"All possible words: {sorted(words)}")
         print(f"Board score: {self.scorer(words)}")
         return words
@@ -239,6 +348,9 @@ class BoggleBoard:
 
     def attempt_word(self, word: str) -> Optional[int]:
         """Check if word is possible in board, and exists in word list"""
+        if len(word) < MIN_WORD_LENGTH:
+            return None
+        word = word.upper()
         if self._is_valid_path(word) and self.word_tree.exists(word):
             return self.scorer(word)
 
@@ -291,10 +403,58 @@ class BoggleBoard:
 
     def __str__(self) -> str:
         return "\n".join(
-            " ".join(dice.face.ljust(2) for dice in dice_row) for dice_row in self.dice
+            " ".join(face.ljust(2) for face in self.faces[i : i + 4])
+            for i in range(0, 16, 4)
         )
 
 
-if __name__ == "main":
+# WordTree shared with each worker process of solve_many, see _attach_worker
+_worker_word_tree: Optional[WordTree] = None
+
+
+def _attach_worker(shared_memory_name: str) -> None:
+    """Attach a worker process to the WordTree shared by solve_many."""
+    global _worker_word_tree
+    _worker_word_tree = WordTree.attach(shared_memory_name)
+
+
+def _solve_in_worker(face_codes: Sequence[int]) -> Set[str]:
+    """solve_board in a worker process, against the shared WordTree."""
+    assert _worker_word_tree is not None, "Worker is not attached to a WordTree."
+    return solve_board(face_codes, _worker_word_tree)
+
+
+def solve_many(
+    boards: Iterable[BoggleBoard], max_workers: Optional[int] = None
+) -> List[Set[str]]:
+    """
+    Get all valid words in each of many boards. Each board is solved
+    independently, so the boards are spread over a pool of processes.
+    Every board shares the same neighbour table and WordTree, so only the
+    face codes of each board are sent to the worker processes, and the
+    WordTree is placed in shared memory, which every worker reads in place
+    rather than loading its own copy.
+
+    Args:
+        boards (Iterable[BoggleBoard]): Boards to solve.
+        max_workers (Optional[int], optional): Number of processes to use.
+            Defaults to the number of CPUs.
+
+    Returns:
+        List[Set[str]]: Set of all valid words in each board, in order.
+    """
+    face_codes = [board.face_codes for board in boards]
+    shm = get_word_tree(WORD_LIST).share()
+    try:
+        with ProcessPoolExecutor(
+            max_workers, initializer=_attach_worker, initargs=(shm.name,)
+        ) as executor:
+            return list(executor.map(_solve_in_worker, face_codes))
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == "__main__":
     a = BoggleBoard()
     a.solver()
@@ -1,75 +1,519 @@
+import hashlib
+import os
+import pickle
+import re
+import struct
+import tempfile
+from array import array
 from functools import lru_cache
-from typing import Optional, Sequence
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from networkx import prefix_tree
+# number of letters, A-Z, which each node in the flattened tree can branch into
+ALPHABET_SIZE = 26
+# Boggle rules: words must be at least this many letters
+MIN_WORD_LENGTH = 3
+# nodes shallower than this are also stored as dense rows, see WordTree.build_arrays
+DENSE_DEPTH = 4
+# label of the root of a flattened tree, the node of the empty word
+ROOT_NODE = 0
+# key marking the end of a word in a prefix tree node, which sorts before
+# the ASCII codes of the letters keying its children
+TERMINAL = ord("$")
+# buffer size used to read word lists
+READ_BUFFER_SIZE = 1 << 20
+# maximum number of prefixes whose nodes are kept by WordTree.search_path
+PREFIX_CACHE_SIZE = 1 << 16
+# directory where built WordTrees are saved, to be loaded on later starts
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyboggle")
+# version of the arrays saved by WordTree, bumped whenever their layout
+# changes so that trees saved by older versions are not loaded
+CACHE_VERSION = 4
+# attributes of WordTree holding its flattened arrays, as shared by WordTree.share
+SHARED_ARRAYS = (
+    "dense_children",
+    "child_offsets",
+    "next_mask",
+    "child_chars",
+    "is_word",
+)
+# format of the header of a shared WordTree, with the
+# typecode and length of each of SHARED_ARRAYS in order
+_SHARED_HEADER = "<" + "cq" * len(SHARED_ARRAYS)
 
 
-def _file_lines_iterator(wordlist_filepath: str, filter: str = ""):
-    with open(wordlist_filepath) as fobj:
-        for line in fobj:
+def _is_letters(word: str) -> bool:
+    """Whether word is made up of only the letters A-Z."""
+    return word.isascii() and word.isalpha() and word.isupper()
+
+
+def _file_lines_iterator(wordlist_filepath: str) -> Iterator[bytes]:
+    # the whole file is read, upper cased and split in C, and bytes.isalpha
+    # is only true for A-Z once upper cased, so nothing is decoded
+    with open(wordlist_filepath, "rb", buffering=READ_BUFFER_SIZE) as fobj:
+        data = fobj.read().upper()
+    for line in data.splitlines():
+        if not line.isalpha():
+            # anything other than A-Z cannot be spelt on a board
             line = line.strip()
-            if line:
-                if not filter or all(char in filter for char in line):
-                    yield line
+            if not line.isalpha():
+                continue
+        yield line
+
+
+def prefix_tree_from_filepath(wordlist_filepath: str) -> Dict[int, Any]:
+    """
+    Builds a prefix tree of a word list as nested dicts. Each node maps
+    the ASCII code of a letter to the child node reached by it, and has the
+    key TERMINAL if the path to it makes up a valid word. Small int keys
+    hash faster than single character strs.
+
+    Args:
+        wordlist_filepath (str): Path to the word list, one word per line.
+
+    Returns:
+        Dict[int, Any]: The root node of the prefix tree.
+    """
+    root: Dict[int, Any] = {}
+    for word in _file_lines_iterator(wordlist_filepath):
+        node = root
+        for letter in word:
+            # unlike setdefault, only creates a dict for a new child
+            child = node.get(letter)
+            if child is None:
+                child = node[letter] = {}
+            node = child
+        node[TERMINAL] = True
+    return root
+
+
+def _align(offset: int) -> int:
+    """Rounds offset up to a multiple of 8, so that any array can start there."""
+    return (offset + 7) & ~7
+
+
+def _walk(advance: Callable[[int, int], int], letters: bytes) -> int:
+    """
+    Follows letters from the root of a flattened tree, one edge at a time,
+    so that walks share the lookup of WordTree.advance.
 
+    Args:
+        advance (Callable[[int, int], int]): WordTree.advance of the tree.
+        letters (bytes): Letters to follow, which must all be A-Z.
 
-def prefix_tree_from_filepath(wordlist_filepath: str, filter: str = ""):
-    return prefix_tree(_file_lines_iterator(wordlist_filepath, filter))
+    Returns:
+        int: The node reached, or -1 if the path does not exist.
+    """
+    node = ROOT_NODE
+    for letter in letters:
+        node = advance(node, letter - 65)
+        if node < 0:
+            return -1
+    return node
 
 
 class WordTree:
-    """A representation of a word list as a prefix tree"""
+    """
+    A representation of a word list as a prefix tree,
+    flattened into arrays indexed by node.
+    """
+
+    def __init__(self, wordlist_filepath: str) -> None:
+        tree = prefix_tree_from_filepath(wordlist_filepath)
+        (
+            self.dense_children,
+            self.child_offsets,
+            self.child_chars,
+            self.is_word,
+            self.next_mask,
+        ) = self.build_arrays(tree)
+        self.dense_nodes = len(self.dense_children) // ALPHABET_SIZE
+        # node reached by each prefix walked by search_path, or None if it
+        # is not a valid path, so that related searches share their walks
+        self._prefix_cache: Dict[str, Optional[int]] = {}
+        # result of each word checked by exists, as the tree never changes
+        self._exists_cache: Dict[str, bool] = {}
+
+    def __getstate__(self) -> dict:
+        # the caches are not worth pickling, so start empty when unpickled
+        state = self.__dict__.copy()
+        state["_prefix_cache"] = {}
+        state["_exists_cache"] = {}
+        return state
+
+    def save(self, filepath: str) -> None:
+        """
+        Saves the flattened tree to a file, to be loaded with WordTree.load.
+
+        Args:
+            filepath (str): Path to save to.
+        """
+        with open(filepath, "wb") as fobj:
+            pickle.dump(self, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filepath: str) -> "WordTree":
+        """
+        Loads a flattened tree saved by WordTree.save. As the arrays are
+        stored as raw bytes, this is much quicker than building the tree
+        from a word list. Only load files from a trusted source.
+
+        Args:
+            filepath (str): Path to load from.
+
+        Returns:
+            WordTree: The loaded WordTree.
+        """
+        with open(filepath, "rb") as fobj:
+            word_tree = pickle.load(fobj)
+        if not isinstance(word_tree, WordTree):
+            raise TypeError(f"{filepath} does not contain a WordTree.")
+        return word_tree
+
+    def share(self) -> SharedMemory:
+        """
+        Copies the flattened tree into a new block of shared memory, so that
+        other processes can read it in place with WordTree.attach instead of
+        each loading their own copy. The caller owns the block, and must
+        close and unlink it once no process needs it.
+
+        Returns:
+            SharedMemory: The block holding the tree.
+        """
+        views = [memoryview(getattr(self, attr)) for attr in SHARED_ARRAYS]
+        header = []
+        for view in views:
+            header += [view.format.encode(), len(view)]
+        offsets = []
+        size = _align(struct.calcsize(_SHARED_HEADER))
+        for view in views:
+            offsets.append(size)
+            size = _align(size + view.nbytes)
+
+        shm = SharedMemory(create=True, size=size)
+        struct.pack_into(_SHARED_HEADER, shm.buf, 0, *header)
+        for view, offset in zip(views, offsets):
+            shm.buf[offset : offset + view.nbytes] = view.cast("B")
+        return shm
+
+    @staticmethod
+    def attach(name: str) -> "WordTree":
+        """
+        Attaches to a tree shared by WordTree.share. The arrays of the tree
+        are read only views of the shared memory, which must outlive it.
+
+        Args:
+            name (str): Name of the block of shared memory.
+
+        Returns:
+            WordTree: The shared WordTree.
+        """
+        shm = SharedMemory(name=name)
+        header = struct.unpack_from(_SHARED_HEADER, shm.buf)
+        word_tree = WordTree.__new__(WordTree)
+        offset = _align(struct.calcsize(_SHARED_HEADER))
+        for attr, typecode, length in zip(SHARED_ARRAYS, header[::2], header[1::2]):
+            nbytes = length * struct.calcsize(typecode.decode())
+            view = shm.buf[offset : offset + nbytes].cast(typecode.decode())
+            setattr(word_tree, attr, view.toreadonly())
+            offset = _align(offset + nbytes)
+        # memoryviews have no find, and the letters are small enough to copy
+        word_tree.child_chars = bytes(word_tree.child_chars)
+        word_tree.dense_nodes = len(word_tree.dense_children) // ALPHABET_SIZE
+        word_tree._prefix_cache = {}
+        word_tree._exists_cache = {}
+        # keeps the memory mapped for as long as the tree is in use
+        word_tree._shared_memory = shm
+        return word_tree
+
+    @staticmethod
+    def build_arrays(
+        tree: Dict[int, Any],
+    ) -> Tuple[array, array, bytearray, bytearray, array]:
+        """
+        Flattens a prefix tree into compressed sparse rows, where the edges
+        out of each node are stored contiguously, sorted by letter. Nodes
+        are renumbered breadth first, with the root as node ROOT_NODE, so
+        that the children of a node are consecutive, and the node reached by
+        edge i is always node i + 1. This takes a few bytes per edge, rather
+        than a row of ALPHABET_SIZE ints per node.
+
+        Nodes near the root are visited by almost every search, and have
+        most letters as children, so those shallower than DENSE_DEPTH are
+        also stored as rows of ALPHABET_SIZE ints, to be indexed directly.
+        Being labelled breadth first, they are the first dense_nodes nodes.
 
-    def __init__(self, wordlist_filepath: str, filter: str = "") -> None:
-        self.tree = prefix_tree_from_filepath(wordlist_filepath, filter)
+        Args:
+            tree (Dict[int, Any]): Root node, as per prefix_tree_from_filepath.
+
+        Returns:
+            Tuple[array, array, bytearray, bytearray, array]: dense_children,
+                child_offsets, child_chars, is_word and next_mask.
+                dense_children[node * ALPHABET_SIZE + code] is the child of
+                node reached by the letter chr(code + 65), or -1 if there is
+                none, for each node shallower than DENSE_DEPTH.
+                The edges out of node are child_offsets[node] up to
+                child_offsets[node + 1], and edge i is labelled with the
+                letter child_chars[i], as an ASCII code.
+                is_word[node] is 1 if the path to node makes up a valid word.
+                Bit code of next_mask[node] is set if node has a child reached
+                by the letter chr(code + 65), so that a missing edge can be
+                rejected with a single bitwise and.
+        """
+        order = [tree]
+        # number of nodes shallower than DENSE_DEPTH, and the depth and end
+        # label of the nodes being visited
+        dense_nodes = 0
+        depth = 0
+        depth_end = 1
+        child_offsets = array("i")
+        child_chars = bytearray()
+        next_mask = array("l")
+        # order grows as it is iterated over, giving a breadth first traversal
+        for label, node in enumerate(order):
+            if label == depth_end:
+                # the first node of the next depth
+                depth += 1
+                depth_end = len(order)
+                if depth == DENSE_DEPTH:
+                    dense_nodes = label
+            child_offsets.append(len(child_chars))
+            mask = 0
+            for letter, child in sorted(node.items()):
+                if letter != TERMINAL:
+                    child_chars.append(letter)
+                    mask |= 1 << (letter - 65)
+                    order.append(child)
+            next_mask.append(mask)
+        child_offsets.append(len(child_chars))
+        if depth < DENSE_DEPTH:
+            dense_nodes = len(order)
+        is_word = bytearray(TERMINAL in node for node in order)
+
+        dense_children = array("i", [-1]) * (dense_nodes * ALPHABET_SIZE)
+        for label in range(dense_nodes):
+            for edge in range(child_offsets[label], child_offsets[label + 1]):
+                code = child_chars[edge] - 65
+                dense_children[label * ALPHABET_SIZE + code] = edge + 1
+        return dense_children, child_offsets, child_chars, is_word, next_mask
+
+    def advance(self, node: int, code: int) -> int:
+        """
+        Follow a single edge of the flattened tree. A search over a board
+        should carry the node reached by its path, starting from ROOT_NODE,
+        and advance it one letter at a time, rather than searching each word
+        it spells from the root. Whether the node reached makes up a word is
+        is_word[node], which is kept apart so that no tuple is built per edge.
+
+        Args:
+            node (int): The node to start from.
+            code (int): The letter to follow, with A as 0 to Z as 25.
+
+        Returns:
+            int: The node reached, or -1 if there is no such edge.
+        """
+        if node < self.dense_nodes:
+            return self.dense_children[node * ALPHABET_SIZE + code]
+        if not self.next_mask[node] >> code & 1:
+            return -1
+        # the edge is known to exist, so find never runs past the node's edges
+        return self.child_chars.find(code + 65, self.child_offsets[node]) + 1
 
-        # cache the method calls
-        # https://rednafi.github.io/reflections/dont-wrap-instance-methods-with-functoolslru_cache-decorator-in-python.html
-        self.exists = lru_cache()(self._exists)
-        self.search_path = lru_cache()(self._search_path)
+    def exists(self, word: str) -> bool:
+        """
+        Checks if word is a valid word, caching the result.
+        Words are case insensitive.
+
+        Args:
+            word (str): Word to check.
 
-    def _exists(self, word: str):
-        if len(word) < 3:
-            # Boggle rules: word must be at least 3 letters
+        Returns:
+            bool: Whether word is a valid word or not
+        """
+        if len(word) < MIN_WORD_LENGTH:
+            # cheaper than a cache lookup, and keeps short words out of it
             return False
-        node_label = self._search_path(word)
-        if node_label is None:
+        word = word.upper()
+        result = self._exists_cache.get(word)
+        if result is None:
+            result = self._exists_cache[word] = self._exists(word)
+        return result
+
+    def _exists(self, word: str) -> bool:
+        # word must already be upper case, and at least MIN_WORD_LENGTH long
+        if not _is_letters(word):
             return False
-        # node -1 is the NIL node as generated by networkx.prefix_tree
-        # it indicates end of a word, hence paths ending with
-        # node -1 make up a valid word
-        return -1 in self.tree.successors(node_label)
+        node = _walk(self.advance, word.encode("ascii"))
+        return node >= 0 and bool(self.is_word[node])
+
+    def exists_many(self, words: Iterable[str]) -> List[bool]:
+        """
+        Checks if each of many case insensitive words exists, in a single
+        loop over the words. This skips the per call overhead and cache
+        of exists, which is not worth hashing for a batch of mostly new words.
 
-    def _search_path(self, word: Sequence[str], node: int = 0) -> Optional[int]:
+        Args:
+            words (Iterable[str]): Words to check.
+
+        Returns:
+            List[bool]: Whether each word exists, in order.
+        """
+        advance = self.advance
+        is_word = self.is_word
+        results = []
+        for word in words:
+            word = word.upper()
+            if len(word) < MIN_WORD_LENGTH or not _is_letters(word):
+                results.append(False)
+                continue
+            node = _walk(advance, word.encode("ascii"))
+            results.append(node >= 0 and bool(is_word[node]))
+        return results
+
+    def search_path(self, word: str) -> Optional[int]:
         """
-        A recursive method that checks if supplied sequence of letters
-        is a valid path (valid word) in self.tree.
+        Checks if supplied sequence of letters is a valid path
+        (valid word) in the flattened tree.
+
+        The walk resumes from the longest prefix of word already walked by
+        an earlier search, and the node of every prefix walked is kept, so
+        searching "ABDOMINO" after "ABDOMIN" only follows one more edge.
 
         Args:
-            word (Sequence[str]): A sequence of str. Likely a str, or a list of str.
-            node (int, optional): The node to start searching from. Defaults to 0.
+            word (str): A sequence of letters, case insensitive.
 
         Returns:
             Optional[int]: None if path does not exist,
             otherwise the node label of the last element.
         """
-        if len(word) == 0:
-            # base case reached, word sequence is a valid path.
+        word = word.upper()
+        cache = self._prefix_cache
+        length = len(word)
+        while length and word[:length] not in cache:
+            length -= 1
+        node = cache[word[:length]] if length else ROOT_NODE
+        if node is None or length == len(word):
             return node
 
-        # get node where node["source"] == word[0]
-        # networkx.prefix_tree generates nodes with integer labels,
-        # the value is saved as node["source"] = value
-        next_node = next(
-            (
-                node
-                for node in self.tree[node]
-                if self.tree.nodes[node]["source"] == word[0]
-            ),
-            None,
-        )
-
-        if not next_node:
-            return None
-        else:
-            return self.search_path(word[1:], node=next_node)
+        if len(cache) >= PREFIX_CACHE_SIZE:
+            cache.clear()
+        advance = self.advance
+        for i in range(length, len(word)):
+            code = ord(word[i]) - 65
+            if not 0 <= code < ALPHABET_SIZE:
+                node = None
+            else:
+                node = advance(node, code)
+                if node < 0:
+                    node = None
+            cache[word[: i + 1]] = node
+            if node is None:
+                return None
+        return node
+
+
+def _cache_filepath(wordlist_filepath: str, cache_dir: str) -> str:
+    """
+    Path of the saved WordTree of a word list. The file name starts with the
+    name of the word list and a hash of its absolute path, which is shared
+    by every tree saved for that word list, and ends with a hash of
+    CACHE_VERSION and the modification time and size of the word list, so
+    that editing either of them invalidates the saved tree.
+    """
+    abspath = os.path.abspath(wordlist_filepath)
+    path_digest = hashlib.sha1(abspath.encode()).hexdigest()[:8]
+    stat = os.stat(abspath)
+    key = f"{CACHE_VERSION}:{stat.st_mtime_ns}:{stat.st_size}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(abspath))[0]
+    return os.path.join(cache_dir, f"{name}_{path_digest}_{digest}.pkl")
+
+
+def _prune_cache(cache_filepath: str) -> None:
+    """
+    Removes the trees saved alongside cache_filepath for the same word list
+    path, which were keyed by an older CACHE_VERSION or word list, and are
+    never loaded again. Trees of other word lists, including those with the
+    same name in other directories, are kept.
+    """
+    cache_dir, filename = os.path.split(cache_filepath)
+    # the name and path hash of the word list, as per _cache_filepath
+    prefix = filename.rsplit("_", 1)[0]
+    stale = re.compile(rf"{re.escape(prefix)}_[0-9a-f]{{16}}\.pkl")
+    for entry in os.listdir(cache_dir):
+        if entry != filename and stale.fullmatch(entry):
+            try:
+                os.remove(os.path.join(cache_dir, entry))
+            except OSError:
+                pass
+
+
+def load_word_tree(wordlist_filepath: str, cache_dir: Optional[str] = None) -> WordTree:
+    """
+    Loads the WordTree of a word list saved in cache_dir, or builds it and
+    saves it there if there is none, removing any stale trees of the word
+    list. Failing to read or write the cache is not an error, as the tree
+    can always be built from the word list.
+
+    Saved trees are unpickled, so cache_dir must be trusted, and writable by
+    the current user only, as a crafted file there can run arbitrary code.
+
+    Args:
+        wordlist_filepath (str): Path to the word list, one word per line.
+        cache_dir (Optional[str], optional): Directory to save built
+            WordTrees in. Defaults to CACHE_DIR, as set at the time of the call.
+
+    Returns:
+        WordTree: The WordTree of the word list.
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    cache_filepath = _cache_filepath(wordlist_filepath, cache_dir)
+    try:
+        return WordTree.load(cache_filepath)
+    except (
+        OSError,
+        EOFError,
+        pickle.UnpicklingError,
+        # raised by pickles of other versions, or which are corrupted
+        AttributeError,
+        ImportError,
+        IndexError,
+        TypeError,
+        ValueError,
+    ):
+        pass
+
+    word_tree = WordTree(wordlist_filepath)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # save to a temporary file first, so that other processes never
+        # load a partially written tree
+        fd, tmp_filepath = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            word_tree.save(tmp_filepath)
+            os.replace(tmp_filepath, cache_filepath)
+        finally:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+        _prune_cache(cache_filepath)
+    except OSError:
+        pass
+    return word_tree
+
+
+@lru_cache(maxsize=1)
+def get_word_tree(wordlist_filepath: str) -> WordTree:
+    """
+    Get the WordTree of a word list, which is only loaded on the first call,
+    and shared by every later caller. The tree is saved in CACHE_DIR, so it
+    is only built from the word list once, as per load_word_tree.
+
+    Args:
+        wordlist_filepath (str): Path to the word list, one word per line.
+
+    Returns:
+        WordTree: The WordTree of the word list.
+    """
+    return load_word_tree(wordlist_filepath)
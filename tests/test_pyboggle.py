@@ -1,5 +1,184 @@
+import os
+from array import array
+
+import pytest
+
+import pyboggle.words
 from pyboggle import __version__
+from pyboggle.board import (
+    WORD_LIST,
+    BoggleBoard,
+    face_code,
+    solve_board,
+    solve_many,
+)
+from pyboggle.words import WordTree, get_word_tree, load_word_tree
 
 
 def test_version():
     assert __version__ == "0.1.0"
+
+
+@pytest.fixture(scope="session")
+def cache_dir(tmp_path_factory):
+    """A cache directory shared by the session, so the tree is built once."""
+    return tmp_path_factory.mktemp("cache")
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(cache_dir, monkeypatch):
+    """Keep tests from reading or writing the user's cache directory."""
+    monkeypatch.setattr(pyboggle.words, "CACHE_DIR", str(cache_dir))
+    get_word_tree.cache_clear()
+    yield
+    get_word_tree.cache_clear()
+
+
+def board_from_faces(*faces):
+    """A BoggleBoard with the given faces, row by row, in place of random ones."""
+    board = BoggleBoard()
+    board.faces = faces
+    board.face_codes = array("b", map(face_code, faces))
+    return board
+
+
+def test_is_valid_path():
+    # fmt: off
+    board = board_from_faces(
+        "Qu", "A", "Y", "S",
+        "E", "T", "O", "N",
+        "R", "I", "L", "D",
+        "B", "C", "F", "G",
+    )
+    # fmt: on
+    assert board._is_valid_path("QUAY")
+    assert board._is_valid_path("TON")
+    assert board._is_valid_path("ONE") is False  # E is not adjacent to N
+    assert board._is_valid_path("TOT") is False  # T cannot be reused
+    assert board._is_valid_path("QAY") is False  # Q only appears as Qu
+
+
+def test_solve_board():
+    # fmt: off
+    board = board_from_faces(
+        "Qu", "I", "T", "V",
+        "J", "X", "O", "Z",
+        "V", "J", "O", "X",
+        "Z", "V", "T", "J",
+    )
+    # fmt: on
+    word_tree = get_word_tree(WORD_LIST)
+    words = solve_board(board.face_codes, word_tree)
+    # QUIT starts on the Qu face, TOOT uses both T dice, and TOO, OXO and
+    # ZOO use both O dice. IT is in the word list, but too short
+    assert words == {
+        "JOT",
+        "OOT",
+        "OXO",
+        "QUIT",
+        "TIX",
+        "TOO",
+        "TOOT",
+        "VOX",
+        "ZOO",
+        "ZOOT",
+    }
+    node = word_tree.search_path("IT")
+    assert node is not None and word_tree.is_word[node]
+    assert "IT" not in board.solver()
+    assert board.solver() == words
+
+
+def test_exists_many():
+    word_tree = get_word_tree(WORD_LIST)
+    words = ["QUAY", "AA", "QUAYX", "QZQ", "ABDOMINOPLASTY"]
+    assert word_tree.exists_many(words) == [word_tree.exists(w) for w in words]
+    assert word_tree.exists_many(words) == [True, False, False, False, True]
+
+
+def test_exists_case_insensitive():
+    word_tree = get_word_tree(WORD_LIST)
+    assert word_tree.exists("abdominoplasty")
+    assert word_tree.exists("Quay")
+    assert not word_tree.exists("QU4Y")
+
+
+def test_load_word_tree_cache(tmp_path):
+    wordlist = tmp_path / "words.txt"
+    wordlist.write_text("cat\ndog\n")
+    cache_dir = tmp_path / "cache"
+    built = load_word_tree(str(wordlist), str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+    loaded = load_word_tree(str(wordlist), str(cache_dir))
+    assert loaded is not built
+    assert loaded.exists_many(["CAT", "DOG", "COG"]) == [True, True, False]
+    # a corrupt saved tree is rebuilt, rather than raising
+    (saved,) = cache_dir.iterdir()
+    saved.write_bytes(saved.read_bytes()[:-10])
+    assert load_word_tree(str(wordlist), str(cache_dir)).exists("CAT")
+    saved.write_bytes(b"\x80\x05c__no_such_module__\nX\n.")
+    assert load_word_tree(str(wordlist), str(cache_dir)).exists("CAT")
+    # editing the word list replaces its saved tree, rather than adding one
+    (cache_dir / "other_0123456789abcdef.pkl").write_bytes(b"")
+    wordlist.write_text("cat\ndog\ncog\n")
+    edited = load_word_tree(str(wordlist), str(cache_dir))
+    assert edited.exists("COG")
+    assert sorted(path.name for path in cache_dir.iterdir()) == [
+        "other_0123456789abcdef.pkl",
+        os.path.basename(pyboggle.words._cache_filepath(str(wordlist), str(cache_dir))),
+    ]
+
+
+def test_load_word_tree_cache_same_name(tmp_path):
+    cache_dir = tmp_path / "cache"
+    wordlists = []
+    for directory, text in [("a", "cat\n"), ("b", "dog\n")]:
+        (tmp_path / directory).mkdir()
+        wordlist = tmp_path / directory / "words.txt"
+        wordlist.write_text(text)
+        wordlists.append(str(wordlist))
+    for wordlist in wordlists:
+        load_word_tree(wordlist, str(cache_dir))
+    # neither word list's saved tree is pruned when the other is saved
+    assert sorted(path.name for path in cache_dir.iterdir()) == sorted(
+        os.path.basename(pyboggle.words._cache_filepath(wordlist, str(cache_dir)))
+        for wordlist in wordlists
+    )
+    assert load_word_tree(wordlists[0], str(cache_dir)).exists("CAT")
+    assert load_word_tree(wordlists[1], str(cache_dir)).exists("DOG")
+
+
+def test_shared_word_tree():
+    word_tree = get_word_tree(WORD_LIST)
+    shm = word_tree.share()
+    try:
+        shared = WordTree.attach(shm.name)
+        words = ["QUAY", "AA", "QUAYX", "ABDOMINOPLASTY"]
+        assert shared.exists_many(words) == word_tree.exists_many(words)
+        assert shared.search_path("ABDOMIN") == word_tree.search_path("ABDOMIN")
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_solve_many():
+    # fmt: off
+    boards = [
+        board_from_faces(
+            "Qu", "A", "Y", "S",
+            "E", "T", "O", "N",
+            "R", "I", "L", "D",
+            "B", "C", "F", "G",
+        ),
+        board_from_faces(
+            "S", "T", "A", "R",
+            "E", "A", "T", "S",
+            "L", "I", "N", "E",
+            "D", "O", "G", "S",
+        ),
+    ]
+    # fmt: on
+    word_tree = get_word_tree(WORD_LIST)
+    expected = [solve_board(board.face_codes, word_tree) for board in boards]
+    assert all(expected)
+    assert solve_many(boards, max_workers=1) == expected